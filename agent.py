@@ -1,10 +1,12 @@
 import os
 import sys
+import time
 import yaml
 import requests
 import json
 from dotenv import load_dotenv
-from tools import TOOL_DEFINITIONS, call_tool, init_agent_id
+import jsonutil
+from tools import TOOL_DEFINITIONS, call_tool, init_agent_id, init_triage, triage_notifications
 
 load_dotenv()
 
@@ -23,6 +25,7 @@ SYSTEM_PROMPT = config["system"]
 MODEL = config["model"]
 MEMORY_DIR = config.get("memory_dir", "memory/")
 AGENT_NAME = config.get("name", "agent")
+TRIAGE_CONFIG = config.get("triage")
 MEMORY_FILE = os.path.join(MEMORY_DIR, f"{AGENT_NAME}_messages.json")
 
 # Ensure memory directory exists
@@ -31,25 +34,60 @@ def ensure_memory_dir():
         os.makedirs(MEMORY_DIR)
 
 
+# Encoded JSON bytes of every message already in the history, kept in step with
+# the message dicts themselves. Messages are treated as immutable once appended,
+# so each turn only the new tail has to be encoded.
+_MESSAGE_OBJECTS = []
+_MESSAGE_BYTES = []
+_TOOLS_CACHE = (None, b"")
+
+
+def encode_messages(messages):
+    """
+    Return the encoded JSON bytes of each message, encoding only messages not seen before.
+    The cache is truncated at the first message that differs from the cached prefix.
+    """
+    keep = 0
+    for cached, message in zip(_MESSAGE_OBJECTS, messages):
+        if cached is not message:
+            break
+        keep += 1
+    del _MESSAGE_OBJECTS[keep:]
+    del _MESSAGE_BYTES[keep:]
+    for message in messages[keep:]:
+        _MESSAGE_OBJECTS.append(message)
+        _MESSAGE_BYTES.append(jsonutil.dumps(message))
+    return _MESSAGE_BYTES
+
+
+def encode_tools(tools):
+    global _TOOLS_CACHE
+    if _TOOLS_CACHE[0] is not tools:
+        _TOOLS_CACHE = (tools, jsonutil.dumps(tools))
+    return _TOOLS_CACHE[1]
+
+
 def load_messages():
     ensure_memory_dir()
     if os.path.exists(MEMORY_FILE):
-        with open(MEMORY_FILE, "r") as f:
-            return json.load(f)
+        with open(MEMORY_FILE, "rb") as f:
+            return jsonutil.loads(f.read())
     else:
         return [{"role": "system", "content": SYSTEM_PROMPT}]
 
 
 def save_messages(messages):
     ensure_memory_dir()
-    with open(MEMORY_FILE, "w") as f:
-        json.dump(messages, f, indent=2)
+    # Reuses the bytes already encoded for the request body, one message per line
+    with open(MEMORY_FILE, "wb") as f:
+        f.write(b"[\n" + b",\n".join(encode_messages(messages)) + b"\n]\n")
 
 
 def call_llm(messages, tools, model):
     """
     Call OpenRouter API with messages and tools. Returns the response dict.
     Uses middle-out transform to automatically truncate input if needed.
+    The tools and message history are spliced in from their cached encodings.
     """
     headers = {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
@@ -57,12 +95,16 @@ def call_llm(messages, tools, model):
     }
     payload = {
         "model": model,
-        "messages": messages,
-        "tools": tools,
         "tool_choice": "auto",
         "transforms": ["middle-out"]  # Ensure automatic truncation if needed
     }
-    resp = requests.post(OPENROUTER_BASE_URL, headers=headers, json=payload)
+    body = (
+        jsonutil.dumps(payload)[:-1]
+        + b',"tools":' + encode_tools(tools)
+        + b',"messages":' + jsonutil.join_array(encode_messages(messages))
+        + b"}"
+    )
+    resp = requests.post(OPENROUTER_BASE_URL, headers=headers, data=body)
     try:
         resp.raise_for_status()
         return resp.json()
@@ -74,10 +116,34 @@ def call_llm(messages, tools, model):
 def main(turns=10):
     # Initialize agent ID once at startup
     init_agent_id()
+    triage = init_triage(TRIAGE_CONFIG)
     messages = load_messages()
+    idle_turns = 0
     print(f"[AIBoards Agent '{AGENT_NAME}' Started]")
     for turn in range(turns):
         print(f"\n--- Turn {turn+1} ---")
+        if triage and triage.config.get("poll_each_turn"):
+            batch = triage_notifications()
+            if "error" in batch:
+                print(f"[TRIAGE ERROR] {batch['error']}")
+                messages.append({
+                    "role": "user",
+                    "content": f"Notification check failed: {batch['error']}"
+                })
+            elif batch["items"]:
+                messages.append({
+                    "role": "user",
+                    "content": "New notifications (triaged): " + json.dumps(batch["items"])
+                })
+            elif (triage.config.get("skip_idle_turns") and messages[-1]["role"] == "assistant"
+                    and idle_turns < triage.config.get("explore_every", 5)):
+                # The model finished its last action and nothing new needs it;
+                # every explore_every idle turns it still gets a turn to explore
+                idle_turns += 1
+                print(f"[TRIAGE] Nothing actionable, skipping LLM call; next poll in {triage.config.get('idle_wait', 30)}s")
+                time.sleep(triage.config.get("idle_wait", 30))
+                continue
+        idle_turns = 0
         llm_response = call_llm(messages, TOOL_DEFINITIONS, MODEL)
         choice = llm_response["choices"][0]
         message = choice.get("message")
@@ -0,0 +1,145 @@
+"""
+JSON encoding helpers shared by the agent loop and the tool layer.
+Uses orjson when it is installed and falls back to the standard library.
+"""
+import codecs
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+BACKEND = "orjson" if orjson else "json"
+
+
+def dumps(obj):
+    """Encode obj as compact UTF-8 JSON bytes."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except orjson.JSONEncodeError:
+            pass  # e.g. lone surrogates, which orjson rejects
+    # ASCII escapes keep lone surrogates from model or tool text encodable
+    return json.dumps(obj, separators=(",", ":")).encode("ascii")
+
+
+def loads(data):
+    """Decode JSON from bytes or str."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # e.g. escaped lone surrogates written by the dumps fallback
+    return json.loads(data)
+
+
+def join_array(encoded_items):
+    """Splice already-encoded JSON values into an encoded JSON array."""
+    return b"[" + b",".join(encoded_items) + b"]"
+
+
+_DECODER = json.JSONDecoder()
+_WS = " \t\r\n"
+
+
+def _skip(text, idx, chars=_WS):
+    while idx < len(text) and text[idx] in chars:
+        idx += 1
+    return idx
+
+
+class LeadingItemsDecoder:
+    """
+    Incrementally decode the complete items at the start of a JSON document fed in chunks.
+    Handles a top-level array, or the first array-valued key of a top-level object;
+    the values of the keys before that array are kept in `fields`.
+    A value counts as complete only once something follows it, so a number cut
+    mid-digit is never taken for a whole one.
+    """
+
+    def __init__(self, max_items=None):
+        self.max_items = max_items
+        self.fields = {}
+        self.key = None
+        self.items = []
+        self.is_array = False  # whether the document itself is the array
+        self.state = "start"  # start -> fields -> items -> done
+        self._text = ""
+        self._utf8 = codecs.getincrementaldecoder("utf-8")("ignore")
+
+    @property
+    def full(self):
+        return self.max_items is not None and len(self.items) >= self.max_items
+
+    @property
+    def in_items(self):
+        """True while the item array is still open, i.e. a cut here drops later items."""
+        return self.state == "items" and not self.full
+
+    def feed(self, chunk):
+        self._text += self._utf8.decode(chunk)
+        idx = self._advance(self._text)
+        self._text = self._text[idx:]
+
+    def _decode(self, text, idx):
+        # Returns (value, end), or None when the value is not complete yet
+        try:
+            value, end = _DECODER.raw_decode(text, idx)
+        except ValueError:
+            return None
+        return None if end >= len(text) else (value, end)
+
+    def _advance(self, text):
+        idx = 0
+        while self.state != "done" and not self.full:
+            idx = _skip(text, idx, _WS + ("," if self.state != "start" else ""))
+            if idx >= len(text):
+                break
+            if self.state == "start":
+                self.state = {"[": "items", "{": "fields"}.get(text[idx], "done")
+                self.is_array = self.state == "items"
+                idx += 1
+            elif self.state == "items":
+                if text[idx] == "]":
+                    self.state = "done"
+                    break
+                decoded = self._decode(text, idx)
+                if decoded is None:
+                    break
+                self.items.append(decoded[0])
+                idx = decoded[1]
+            else:
+                if text[idx] == "}":
+                    self.state = "done"
+                    break
+                decoded = self._decode(text, idx)
+                if decoded is None:
+                    break
+                key, colon = decoded
+                colon = _skip(text, colon)
+                value_at = _skip(text, colon + 1)
+                if value_at >= len(text):
+                    break
+                if text[colon] != ":":
+                    self.state = "done"
+                    break
+                if text[value_at] == "[":
+                    self.key = key
+                    self.state = "items"
+                    idx = value_at + 1
+                    continue
+                decoded = self._decode(text, value_at)
+                if decoded is None:
+                    break
+                self.fields[key] = decoded[0]
+                idx = decoded[1]
+        return idx
+
+    def result(self):
+        """The decoded part in the document's own shape: a list, or an object with the fields and item key seen so far."""
+        if self.is_array:
+            return self.items
+        if self.key is None:
+            return dict(self.fields)
+        return {**self.fields, self.key: self.items}
@@ -0,0 +1,194 @@
+"""
+Local executor for multi-step tool plans submitted through the run_plan tool.
+A step argument that is exactly "$<step_id>.<path>" (e.g. "$boards.items[0].id")
+is replaced by that value; "${<step_id>.<path>}" is interpolated into text.
+Any other "$" text is left alone. Steps may be guarded by a simple `if`
+condition, and independent steps run concurrently.
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_PLAN_STEPS = 20
+MAX_PLAN_WORKERS = 4
+CONDITION_OPS = {"exists", "empty", "eq", "ne", "gt", "lt"}
+
+_REF_BODY = r"([A-Za-z_]\w*)((?:\.[A-Za-z_]\w*|\[-?\d+\])*)"
+_REF = re.compile(r"\$" + _REF_BODY)
+_EMBEDDED_REF = re.compile(r"\$\{" + _REF_BODY + r"\}")
+_PATH_PART = re.compile(r"\.([A-Za-z_]\w*)|\[(-?\d+)\]")
+_MISSING = object()
+
+
+class PlanError(Exception):
+    pass
+
+
+class _Unresolved(Exception):
+    pass
+
+
+def run_plan(steps, call, extract_items):
+    """
+    Validate and execute a plan. call(tool_call) runs one tool call and
+    extract_items(result) returns the list of items in a tool result.
+    Returns one consolidated result with the status and result of every step.
+    """
+    _validate(steps)
+    deps = {step["id"]: _step_refs(step) for step in steps}
+    run = _PlanRun(extract_items)
+    pending = list(steps)
+    with ThreadPoolExecutor(max_workers=MAX_PLAN_WORKERS) as pool:
+        while pending:
+            ready = [step for step in pending if deps[step["id"]] <= run.outcomes.keys()]
+            pending = [step for step in pending if step not in ready]
+            futures = {}
+            for step in ready:
+                outcome, args = run.prepare(step, deps[step["id"]])
+                if outcome is None:
+                    futures[step["id"]] = pool.submit(call, {"name": step["tool"], "arguments": args})
+                else:
+                    run.outcomes[step["id"]] = outcome
+            for step_id, future in futures.items():
+                result = future.result()
+                failed = isinstance(result, dict) and "error" in result
+                run.outcomes[step_id] = {"status": "error" if failed else "ok", "result": result}
+    return {"steps": [{"id": step["id"], "tool": step["tool"], **run.outcomes[step["id"]]} for step in steps]}
+
+
+def _validate(steps):
+    if not isinstance(steps, list) or not steps:
+        raise PlanError("Plan must be a non-empty list of steps")
+    if len(steps) > MAX_PLAN_STEPS:
+        raise PlanError(f"Plan has {len(steps)} steps; the limit is {MAX_PLAN_STEPS}")
+    seen = set()
+    for step in steps:
+        if not isinstance(step, dict) or not isinstance(step.get("args", {}), dict):
+            raise PlanError(f"Each step must be an object with an args object: {step!r}")
+        step_id = step.get("id")
+        if not step_id or step_id in seen:
+            raise PlanError(f"Step ids must be unique and non-empty: {step_id!r}")
+        if not step.get("tool") or step["tool"] == "run_plan":
+            raise PlanError(f"Step {step_id} has an invalid tool: {step.get('tool')!r}")
+        condition = step.get("if")
+        if condition is not None and _condition_ref(condition) is None:
+            raise PlanError(f"Step {step_id} has an invalid condition: {condition!r}")
+        if isinstance(condition, dict) and condition.get("op", "exists") not in CONDITION_OPS:
+            raise PlanError(f"Step {step_id} has an unknown condition op: {condition['op']}")
+        # Only earlier steps can be referenced, which also rules out cycles
+        unknown = _step_refs(step) - seen
+        if unknown:
+            raise PlanError(f"Step {step_id} references unknown or later steps: {sorted(unknown)}")
+        seen.add(step_id)
+
+
+def _condition_ref(condition):
+    """Return the reference match of a condition, or None if it is not a reference."""
+    if isinstance(condition, str):
+        return _REF.fullmatch(condition[1:] if condition.startswith("!") else condition)
+    if isinstance(condition, dict) and isinstance(condition.get("ref"), str):
+        return _REF.fullmatch(condition["ref"])
+    return None
+
+
+def _step_refs(step):
+    refs = _refs(step.get("args", {}))
+    if step.get("if") is not None:
+        refs.add(_condition_ref(step["if"]).group(1))
+    return refs
+
+
+def _refs(value):
+    """Return the ids of all steps referenced in value, in the same forms _resolve substitutes."""
+    if isinstance(value, str):
+        match = _REF.fullmatch(value)
+        if match:
+            return {match.group(1)}
+        return {match.group(1) for match in _EMBEDDED_REF.finditer(value)}
+    if isinstance(value, dict):
+        return set().union(*(_refs(v) for v in value.values()))
+    if isinstance(value, list):
+        return set().union(*(_refs(v) for v in value))
+    return set()
+
+
+class _PlanRun:
+    def __init__(self, extract_items):
+        self.extract_items = extract_items
+        self.outcomes = {}
+
+    def prepare(self, step, deps):
+        """
+        Return (outcome, None) if the step cannot or should not run, otherwise
+        (None, args) with its references substituted.
+        """
+        failed = sorted(dep for dep in deps if self.outcomes[dep]["status"] != "ok")
+        if failed:
+            return {"status": "skipped", "reason": f"depends on failed or skipped steps: {failed}"}, None
+        if step.get("if") is not None and not self.check(step["if"]):
+            return {"status": "skipped", "reason": "condition not met"}, None
+        try:
+            return None, self.resolve(step.get("args", {}))
+        except _Unresolved as e:
+            return {"status": "skipped", "reason": f"reference did not resolve: {e}"}, None
+
+    def check(self, condition):
+        # A reference that does not resolve counts as None here, which is what "exists" tests
+        match = _condition_ref(condition)
+        value = self.lookup(match.group(1), match.group(2))
+        value = None if value is _MISSING else value
+        if isinstance(condition, str):
+            return not value if condition.startswith("!") else bool(value)
+        op = condition.get("op", "exists")
+        expected = condition.get("value")
+        if op == "exists":
+            return value is not None
+        if op == "empty":
+            return not value
+        if op == "eq":
+            return value == expected
+        if op == "ne":
+            return value != expected
+        try:
+            return value > expected if op == "gt" else value < expected
+        except TypeError:
+            return False
+
+    def resolve(self, value):
+        """
+        Substitute references in value. A string that is a single reference keeps
+        the referenced type. Raises _Unresolved when a reference has no value.
+        """
+        if isinstance(value, dict):
+            return {k: self.resolve(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.resolve(v) for v in value]
+        if not isinstance(value, str):
+            return value
+        match = _REF.fullmatch(value)
+        if match:
+            return self._required(match)
+        return _EMBEDDED_REF.sub(lambda m: str(self._required(m)), value)
+
+    def _required(self, match):
+        value = self.lookup(match.group(1), match.group(2))
+        if value is _MISSING or value is None:
+            raise _Unresolved(match.group(0))
+        return value
+
+    def lookup(self, step_id, path):
+        value = self.outcomes[step_id].get("result")
+        for key, index in _PATH_PART.findall(path):
+            if key:
+                if isinstance(value, dict) and key in value:
+                    value = value[key]
+                elif key == "items":
+                    # Lets plans address list results uniformly, whatever key the API uses
+                    value = self.extract_items(value)
+                else:
+                    return _MISSING
+            else:
+                try:
+                    value = value[int(index)]
+                except (IndexError, KeyError, TypeError):
+                    return _MISSING
+        return value
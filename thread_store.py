@@ -0,0 +1,234 @@
+"""
+Local store of materialized reply trees, keyed by post_id.
+The first sync of a post downloads the threaded tree; later syncs check the
+post's reply count and page through list_replies past the replies already
+known, reporting only the delta.
+"""
+import threading
+
+# Keys the API may use for nested replies; nodes are normalized to "replies"
+CHILD_KEYS = ("replies", "children")
+# Keys the API may use for a post's reply count, the cheap signal that a thread changed
+REPLY_COUNT_KEYS = ("reply_count", "replies_count")
+REFRESH_PAGE_SIZE = 20
+# Without a reply count, nested replies are only polled under the newest replies
+RECENT_PARENT_POLLS = 3
+# With a reply count, at most this many known replies are polled for missing ones
+# before falling back to one threaded fetch
+MAX_PARENT_POLLS = 10
+
+
+class ThreadStore:
+    def __init__(self, fetch, extract_items):
+        """
+        fetch(tool_name, args) sends an API request and returns the parsed JSON.
+        extract_items(result) returns the list of items in an API result.
+        """
+        self.fetch = fetch
+        self.extract_items = extract_items
+        self.threads = {}
+        self.lock = threading.Lock()
+        # Whether the API's posts carry a reply count; None until a post is fetched
+        self.has_reply_count = None
+
+    def sync(self, post_id, full=False):
+        """
+        Bring the local tree for post_id up to date.
+        Returns the whole tree on first sync or when full is set, otherwise only the new replies.
+        """
+        with self.lock:
+            thread = self.threads.get(post_id)
+            if thread is None:
+                thread = self._load(post_id)
+                if _failed(thread):
+                    return thread
+                self.threads[post_id] = thread
+                full = True
+            else:
+                new = self._refresh(post_id, thread)
+                if _failed(new):
+                    return new
+                if not full:
+                    return self._mark_incomplete(thread, self._delta(post_id, thread, new))
+            return self._mark_incomplete(thread, {
+                "post_id": post_id, "total_replies": len(thread["nodes"]), "replies": thread["replies"],
+            })
+
+    def _load(self, post_id):
+        result = self.fetch("get_threaded_replies", {"post_id": post_id})
+        if _failed(result):
+            return result
+        truncated = isinstance(result, dict) and bool(result.get("truncated"))
+        thread = {"replies": [], "nodes": {}, "order": [], "reply_count": None, "incomplete": truncated}
+        self._merge(thread, self.extract_items(result), post_id)
+        count = self._fetch_reply_count(post_id)
+        if _failed(count):
+            return count
+        thread["reply_count"] = count
+        if truncated:
+            # The byte cap cut the tree: page the post's own replies past the cut,
+            # then look for the rest like a refresh would
+            if count is None:
+                polled = self._poll(thread, "post", post_id)
+                if _failed(polled):
+                    return polled
+            else:
+                found = self._find_missing(post_id, thread, count)
+                if _failed(found):
+                    return found
+        return thread
+
+    def _fetch_reply_count(self, post_id):
+        """Return the post's reply count, None when the API has none, or an error result."""
+        if self.has_reply_count is False:
+            return None
+        post = self.fetch("get_post", {"id": post_id})
+        if _failed(post):
+            return post
+        count = _reply_count(post)
+        self.has_reply_count = count is not None
+        return count
+
+    def _refresh(self, post_id, thread):
+        count = self._fetch_reply_count(post_id)
+        if _failed(count):
+            return count
+        if count is not None:
+            known, thread["reply_count"] = thread["reply_count"], count
+            if count == known and not thread["incomplete"]:
+                return []
+            return self._find_missing(post_id, thread, count)
+        # No usable count: poll the post's own replies and those of the newest replies
+        new = []
+        parents = [("post", post_id)] + [("reply", reply_id) for reply_id in thread["order"][-RECENT_PARENT_POLLS:]]
+        for parent_type, parent_id in parents:
+            polled = self._poll(thread, parent_type, parent_id)
+            if _failed(polled):
+                return polled
+            new += polled
+        return new
+
+    def _find_missing(self, post_id, thread, count):
+        """
+        Page list_replies from the last known position until the store holds `count` replies:
+        the post's own replies first, then those of known replies, newest first, up to
+        MAX_PARENT_POLLS parents. Only if replies are still missing is the tree refetched.
+        """
+        new = self._poll(thread, "post", post_id)
+        if _failed(new):
+            return new
+        for reply_id in list(reversed(thread["order"]))[:MAX_PARENT_POLLS]:
+            if len(thread["nodes"]) >= count:
+                break
+            polled = self._poll(thread, "reply", reply_id)
+            if _failed(polled):
+                return polled
+            new += polled
+        if len(thread["nodes"]) < count:
+            result = self.fetch("get_threaded_replies", {"post_id": post_id})
+            if _failed(result):
+                return result
+            new += self._merge(thread, self.extract_items(result), post_id)
+        thread["incomplete"] = len(thread["nodes"]) < count
+        return new
+
+    def _mark_incomplete(self, thread, result):
+        if thread["incomplete"]:
+            result["incomplete"] = True
+            if thread["reply_count"] is None:
+                result["note"] = "The thread exceeded the response size cap, so the stored tree may be missing replies."
+            else:
+                result["note"] = f"The stored tree is missing replies: only {len(thread['nodes'])} of {thread['reply_count']} could be found."
+        return result
+
+    def _poll(self, thread, parent_type, parent_id):
+        """
+        Fetch list_replies pages for one parent from its last known page on, diffing by id.
+        Re-reading the last known page catches replies shifted back by a deletion.
+        When the server lists newest first, new replies are at the front instead,
+        so paging starts at 1 and stops at the first page with nothing new.
+        """
+        children = thread["replies"] if parent_type == "post" else thread["nodes"][parent_id]["replies"]
+        newest_first = _newest_first(children)
+        page = 1 if newest_first else max(len(children) - 1, 0) // REFRESH_PAGE_SIZE + 1
+        new = []
+        while True:
+            result = self.fetch("list_replies", {
+                "parent_type": parent_type, "parent_id": parent_id,
+                "page": page, "page_size": REFRESH_PAGE_SIZE,
+            })
+            if _failed(result):
+                return result
+            items = self.extract_items(result)
+            added = [
+                self._add(thread, children, item, parent_type, parent_id)
+                for item in items
+                if item.get("id") is not None and item["id"] not in thread["nodes"]
+            ]
+            new += added
+            if len(items) < REFRESH_PAGE_SIZE or (newest_first and not added):
+                return new
+            page += 1
+
+    def _merge(self, thread, items, parent_id, parent_type="post", children=None):
+        """Add replies from a threaded tree that are not known yet; returns the new nodes."""
+        if children is None:
+            children = thread["replies"]
+        new = []
+        for item in items:
+            if item.get("id") is None:
+                continue  # cannot be tracked without an id
+            nested = []
+            for key in CHILD_KEYS:
+                nested = item.get(key) or nested
+            node = thread["nodes"].get(item["id"])
+            if node is None:
+                node = self._add(thread, children, item, parent_type, parent_id)
+                new.append(node)
+            new += self._merge(thread, nested, node["id"], "reply", node["replies"])
+        return new
+
+    def _add(self, thread, children, item, parent_type, parent_id):
+        node = {k: v for k, v in item.items() if k not in CHILD_KEYS}
+        node.setdefault("parent_type", parent_type)
+        node.setdefault("parent_id", parent_id)
+        node["replies"] = []
+        children.append(node)
+        thread["nodes"][node["id"]] = node
+        thread["order"].append(node["id"])
+        return node
+
+    def _delta(self, post_id, thread, new):
+        counts = {}
+        for node in new:
+            parent = (node.get("parent_type"), node.get("parent_id"))
+            counts[parent] = counts.get(parent, 0) + 1
+        parts = [
+            f"{n} new {'reply' if n == 1 else 'replies'} under {parent_type} {parent_id}"
+            for (parent_type, parent_id), n in counts.items()
+        ]
+        return {
+            "post_id": post_id,
+            "total_replies": len(thread["nodes"]),
+            "new_reply_count": len(new),
+            "summary": "; ".join(parts) or "No new replies",
+            "new_replies": [{k: v for k, v in node.items() if k != "replies"} for node in new],
+        }
+
+
+def _failed(result):
+    return isinstance(result, dict) and "error" in result
+
+
+def _reply_count(post):
+    if isinstance(post, dict):
+        for key in REPLY_COUNT_KEYS:
+            if isinstance(post.get(key), int):
+                return post[key]
+    return None
+
+
+def _newest_first(children):
+    # Judged from the creation times of the first replies as the server listed them
+    times = [child.get("created_at") for child in children[:2]]
+    return len(times) == 2 and None not in times and times[0] > times[1]
@@ -1,6 +1,11 @@
 import os
+import threading
 import requests
 from dotenv import load_dotenv
+import jsonutil
+from thread_store import ThreadStore
+from triage import Triage
+from plan import PlanError, run_plan
 
 load_dotenv()
 
@@ -314,11 +319,12 @@ TOOL_DEFINITIONS = [
         "type": "function",
         "function": {
             "name": "get_threaded_replies",
-            "description": "Get all replies for a post in a threaded structure.",
+            "description": "Get all replies for a post in a threaded structure. The first call returns the full tree; later calls for the same post return only the replies that are new since the last call.",
             "parameters": {
                 "type": "object",
                 "properties": {
-                    "post_id": {"type": "string"}
+                    "post_id": {"type": "string"},
+                    "full": {"type": "boolean", "default": False, "description": "Return the whole locally stored tree instead of only new replies."}
                 },
                 "required": ["post_id"]
             }
@@ -511,6 +517,41 @@ TOOL_DEFINITIONS = [
             }
         }
     },
+    # PLAN TOOLS
+    {
+        "type": "function",
+        "function": {
+            "name": "run_plan",
+            "description": (
+                "Run several tool calls in one go and get all their results back together. "
+                "An arg whose whole value is \"$<step_id>.<path>\", e.g. \"$boards.items[0].id\", is replaced by that earlier result "
+                "(\"items\" is the list in any list result); inside text use \"${<step_id>.<path>}\". Other \"$\" text is left as is. "
+                "A step's optional \"if\" is a reference that must be truthy (prefix \"!\" to negate), or "
+                "{\"ref\": ..., \"op\": \"exists|empty|eq|ne|gt|lt\", \"value\": ...}. "
+                "Steps are skipped when their condition fails, a step they reference failed, or a reference has no value. "
+                "Independent steps run concurrently."
+            ),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "steps": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "id": {"type": "string", "description": "Unique step id used in references."},
+                                "tool": {"type": "string", "description": "Name of the tool to call."},
+                                "args": {"type": "object", "description": "Arguments for the tool."},
+                                "if": {"description": "Optional condition on earlier results."}
+                            },
+                            "required": ["id", "tool"]
+                        }
+                    }
+                },
+                "required": ["steps"]
+            }
+        }
+    },
 ]
 
 _AGENT_ID = None
@@ -542,6 +583,208 @@ HEADERS = {
     "Content-Type": "application/json"
 }
 
+# Responses are streamed and read up to a per-tool byte cap so a large thread
+# or page never gets fully buffered. Error logs only show a prefix of the body.
+DEFAULT_MAX_RESPONSE_BYTES = 64 * 1024
+MAX_RESPONSE_BYTES = {
+    "get_threaded_replies": 256 * 1024,
+    "list_board_posts": 128 * 1024,
+    "list_agent_posts": 128 * 1024,
+    "search_board_posts": 128 * 1024,
+    "list_replies": 128 * 1024,
+    "list_agent_replies": 128 * 1024,
+}
+RESPONSE_CHUNK_SIZE = 8 * 1024
+ERROR_BODY_PREFIX = 500
+
+def _request(name, args):
+    """
+    Send the API request for a tool and return the streamed response, or None for an unknown tool.
+    The body is not read here; see _read_json.
+    """
+    if name == "create_post":
+        resp = requests.post(f"{API_BASE_URL}/posts", headers=HEADERS, stream=True, json=args)
+    elif name == "create_reply":
+        resp = requests.post(f"{API_BASE_URL}/replies", headers=HEADERS, stream=True, json=args)
+    elif name == "create_board":
+        resp = requests.post(f"{API_BASE_URL}/boards", headers=HEADERS, stream=True, json=args)
+    elif name == "get_board":
+        resp = requests.get(f"{API_BASE_URL}/boards/{args['id']}", headers=HEADERS, stream=True)
+    elif name == "get_board_by_agent":
+        resp = requests.get(f"{API_BASE_URL}/boards/agent/{args['agent_id']}", headers=HEADERS, stream=True)
+    elif name == "update_board":
+        resp = requests.put(f"{API_BASE_URL}/boards/{args['id']}", headers=HEADERS, stream=True, json=args)
+    elif name == "delete_board":
+        resp = requests.delete(f"{API_BASE_URL}/boards/{args['id']}", headers=HEADERS, stream=True)
+    elif name == "list_boards":
+        resp = requests.get(f"{API_BASE_URL}/boards", headers=HEADERS, stream=True, params=args)
+    elif name == "set_board_active":
+        resp = requests.put(f"{API_BASE_URL}/boards/{args['id']}/active", headers=HEADERS, stream=True, json={"is_active": args["is_active"]})
+    elif name == "search_boards":
+        resp = requests.get(f"{API_BASE_URL}/boards/search", headers=HEADERS, stream=True, params=args)
+    elif name == "get_post":
+        resp = requests.get(f"{API_BASE_URL}/posts/{args['id']}", headers=HEADERS, stream=True)
+    elif name == "list_board_posts":
+        resp = requests.get(f"{API_BASE_URL}/posts/board/{args['board_id']}", headers=HEADERS, stream=True, params=args)
+    elif name == "list_agent_posts":
+        resp = requests.get(f"{API_BASE_URL}/posts/agent/{args['agent_id']}", headers=HEADERS, stream=True, params=args)
+    elif name == "update_post":
+        resp = requests.put(f"{API_BASE_URL}/posts/{args['id']}", headers=HEADERS, stream=True, json=args)
+    elif name == "delete_post":
+        resp = requests.delete(f"{API_BASE_URL}/posts/{args['id']}", headers=HEADERS, stream=True)
+    elif name == "search_board_posts":
+        resp = requests.get(f"{API_BASE_URL}/posts/board/{args['board_id']}/search", headers=HEADERS, stream=True, params=args)
+    elif name == "get_reply":
+        resp = requests.get(f"{API_BASE_URL}/replies/{args['id']}", headers=HEADERS, stream=True)
+    elif name == "list_replies":
+        resp = requests.get(f"{API_BASE_URL}/replies/{args['parent_type']}/{args['parent_id']}", headers=HEADERS, stream=True, params=args)
+    elif name == "list_agent_replies":
+        resp = requests.get(f"{API_BASE_URL}/replies/agent/{args['agent_id']}", headers=HEADERS, stream=True, params=args)
+    elif name == "get_threaded_replies":
+        resp = requests.get(f"{API_BASE_URL}/replies/threaded/{args['post_id']}", headers=HEADERS, stream=True)
+    elif name == "update_reply":
+        resp = requests.put(f"{API_BASE_URL}/replies/{args['id']}", headers=HEADERS, stream=True, json=args)
+    elif name == "delete_reply":
+        resp = requests.delete(f"{API_BASE_URL}/replies/{args['id']}", headers=HEADERS, stream=True)
+    elif name == "create_vote":
+        resp = requests.post(f"{API_BASE_URL}/votes", headers=HEADERS, stream=True, json=args)
+    elif name == "get_vote":
+        resp = requests.get(f"{API_BASE_URL}/votes/{args['id']}", headers=HEADERS, stream=True)
+    elif name == "get_votes_by_target":
+        resp = requests.get(f"{API_BASE_URL}/votes/{args['target_type']}/{args['target_id']}", headers=HEADERS, stream=True, params=args)
+    elif name == "update_vote":
+        resp = requests.put(f"{API_BASE_URL}/votes/{args['id']}", headers=HEADERS, stream=True, json=args)
+    elif name == "delete_vote":
+        resp = requests.delete(f"{API_BASE_URL}/votes/{args['id']}", headers=HEADERS, stream=True)
+    elif name == "get_notification":
+        resp = requests.get(f"{API_BASE_URL}/notifications/{args['id']}", headers=HEADERS, stream=True)
+    elif name == "get_notifications":
+        resp = requests.get(f"{API_BASE_URL}/notifications", headers=HEADERS, stream=True, params=args)
+    elif name == "mark_notification_read":
+        _id = args["id"]
+        resp = requests.put(f"{API_BASE_URL}/notifications/{_id}/read", headers=HEADERS, stream=True)
+    elif name == "mark_all_notifications_read":
+        resp = requests.put(f"{API_BASE_URL}/notifications/read-all", headers=HEADERS, stream=True)
+    elif name == "delete_notification":
+        resp = requests.delete(f"{API_BASE_URL}/notifications/{args['id']}", headers=HEADERS, stream=True)
+    elif name == "get_unread_notification_count":
+        resp = requests.get(f"{API_BASE_URL}/notifications/unread", headers=HEADERS, stream=True)
+    else:
+        return None
+    return resp
+
+
+def _read_json(resp, name, args):
+    """
+    Read and parse a streamed response, reading at most the tool's byte cap.
+    Successful list results are decoded as they arrive and reading stops once
+    page_size complete items are in. A successful response over the cap is cut
+    off, keeping the top-level fields and complete items decoded before the cut.
+    """
+    limit = MAX_RESPONSE_BYTES.get(name, DEFAULT_MAX_RESPONSE_BYTES)
+    ok = 200 <= resp.status_code < 300
+    max_items = None
+    if ok and "page_size" in args:
+        try:
+            max_items = int(args["page_size"])
+        except (TypeError, ValueError):
+            pass
+    decoder = jsonutil.LeadingItemsDecoder(max_items)
+    body = bytearray()
+    truncated = False
+    try:
+        for chunk in resp.iter_content(chunk_size=RESPONSE_CHUNK_SIZE):
+            if len(body) + len(chunk) > limit:
+                chunk = chunk[:limit - len(body)]
+                truncated = True
+            body += chunk
+            if max_items is not None:
+                decoder.feed(chunk)
+                if decoder.full:
+                    return decoder.result()
+            if truncated:
+                break
+    finally:
+        resp.close()
+    if truncated and ok:
+        if max_items is None:
+            decoder.feed(bytes(body))
+        result = decoder.result()
+        if isinstance(result, list):
+            # A cut-off list is wrapped so the truncation note can travel with it
+            result = {"items": result}
+        if decoder.in_items and not decoder.items:
+            note = f"The response was cut off at {limit} bytes inside its first item; the first item alone exceeds the cap."
+        elif decoder.in_items:
+            note = f"The response was cut off at {limit} bytes; only the first {len(decoder.items)} items fit."
+        else:
+            note = f"The response was cut off at {limit} bytes; later fields are missing."
+        print(f"[API TRUNCATED] {name}: {note}")
+        return {**result, "truncated": True, "max_bytes": limit, "note": note}
+    try:
+        if truncated:
+            raise ValueError(f"error response exceeded {limit} bytes")
+        return jsonutil.loads(bytes(body))
+    except Exception as e:
+        raw = body[:ERROR_BODY_PREFIX].decode("utf-8", "ignore")
+        print(f"[API ERROR] {name} {args}")
+        print(f"Status: {resp.status_code}")
+        print("Raw response:", raw)
+        return {"error": f"Failed to parse JSON: {e}", "status_code": resp.status_code, "raw": raw}
+
+
+def _fetch(name, args):
+    return _read_json(_request(name, args), name, args)
+
+def extract_items(result):
+    """Return the list of items in an API result: the result itself, or its first list value."""
+    if isinstance(result, list):
+        return result
+    if isinstance(result, dict):
+        for value in result.values():
+            if isinstance(value, list):
+                return value
+    return []
+
+THREADS = ThreadStore(_fetch, extract_items)
+
+_TRIAGE = None
+# Triage keeps state across calls, and run_plan can call it from several threads
+_TRIAGE_LOCK = threading.Lock()
+
+def init_triage(config):
+    """Enable local triage of notifications with the `triage` section of config.yaml."""
+    global _TRIAGE
+    _TRIAGE = Triage(config) if config else None
+    return _TRIAGE
+
+def triage_notifications(args=None):
+    """
+    Fetch notifications and run them through triage. Trivial ones, and the
+    actionable ones handed back in the ranked, compact batch, are marked read here.
+    """
+    args = dict(args or {})
+    if "page_size" not in args:
+        args["page_size"] = _TRIAGE.config.get("page_size", 20)
+    with _TRIAGE_LOCK:
+        try:
+            result = _fetch("get_notifications", args)
+        except Exception as e:
+            print(f"[TRIAGE ERROR] {e}")
+            return {"error": f"Exception in triage_notifications: {e}"}
+        if isinstance(result, dict) and "error" in result:
+            return result
+        batch = _TRIAGE.run(extract_items(result), get_agent_id())
+        # A failed mark-read only means the notification may come back; the batch still goes out
+        for _id in batch["handled"]:
+            try:
+                _fetch("mark_notification_read", {"id": _id})
+            except Exception as e:
+                print(f"[TRIAGE ERROR] Could not mark {_id} read: {e}")
+    print(f"[TRIAGE] {len(batch['items'])} actionable, {len(batch['handled'])} marked read, {batch['ignored']} ignored")
+    return batch
+
+
 def call_tool(tool_call):
     """
     Dispatch a tool call to the correct API endpoint and return the JSON response.
@@ -557,83 +800,18 @@ def call_tool(tool_call):
         args["agent_id"] = get_agent_id()
 
     try:
-        if name == "create_post":
-            resp = requests.post(f"{API_BASE_URL}/posts", headers=HEADERS, json=args)
-        elif name == "create_reply":
-            resp = requests.post(f"{API_BASE_URL}/replies", headers=HEADERS, json=args)
-        elif name == "create_board":
-            resp = requests.post(f"{API_BASE_URL}/boards", headers=HEADERS, json=args)
-        elif name == "get_board":
-            resp = requests.get(f"{API_BASE_URL}/boards/{args['id']}", headers=HEADERS)
-        elif name == "get_board_by_agent":
-            resp = requests.get(f"{API_BASE_URL}/boards/agent/{args['agent_id']}", headers=HEADERS)
-        elif name == "update_board":
-            resp = requests.put(f"{API_BASE_URL}/boards/{args['id']}", headers=HEADERS, json=args)
-        elif name == "delete_board":
-            resp = requests.delete(f"{API_BASE_URL}/boards/{args['id']}", headers=HEADERS)
-        elif name == "list_boards":
-            resp = requests.get(f"{API_BASE_URL}/boards", headers=HEADERS, params=args)
-        elif name == "set_board_active":
-            resp = requests.put(f"{API_BASE_URL}/boards/{args['id']}/active", headers=HEADERS, json={"is_active": args["is_active"]})
-        elif name == "search_boards":
-            resp = requests.get(f"{API_BASE_URL}/boards/search", headers=HEADERS, params=args)
-        elif name == "get_post":
-            resp = requests.get(f"{API_BASE_URL}/posts/{args['id']}", headers=HEADERS)
-        elif name == "list_board_posts":
-            resp = requests.get(f"{API_BASE_URL}/posts/board/{args['board_id']}", headers=HEADERS, params=args)
-        elif name == "list_agent_posts":
-            resp = requests.get(f"{API_BASE_URL}/posts/agent/{args['agent_id']}", headers=HEADERS, params=args)
-        elif name == "update_post":
-            resp = requests.put(f"{API_BASE_URL}/posts/{args['id']}", headers=HEADERS, json=args)
-        elif name == "delete_post":
-            resp = requests.delete(f"{API_BASE_URL}/posts/{args['id']}", headers=HEADERS)
-        elif name == "search_board_posts":
-            resp = requests.get(f"{API_BASE_URL}/posts/board/{args['board_id']}/search", headers=HEADERS, params=args)
-        elif name == "get_reply":
-            resp = requests.get(f"{API_BASE_URL}/replies/{args['id']}", headers=HEADERS)
-        elif name == "list_replies":
-            resp = requests.get(f"{API_BASE_URL}/replies/{args['parent_type']}/{args['parent_id']}", headers=HEADERS, params=args)
-        elif name == "list_agent_replies":
-            resp = requests.get(f"{API_BASE_URL}/replies/agent/{args['agent_id']}", headers=HEADERS, params=args)
-        elif name == "get_threaded_replies":
-            resp = requests.get(f"{API_BASE_URL}/replies/threaded/{args['post_id']}", headers=HEADERS)
-        elif name == "update_reply":
-            resp = requests.put(f"{API_BASE_URL}/replies/{args['id']}", headers=HEADERS, json=args)
-        elif name == "delete_reply":
-            resp = requests.delete(f"{API_BASE_URL}/replies/{args['id']}", headers=HEADERS)
-        elif name == "create_vote":
-            resp = requests.post(f"{API_BASE_URL}/votes", headers=HEADERS, json=args)
-        elif name == "get_vote":
-            resp = requests.get(f"{API_BASE_URL}/votes/{args['id']}", headers=HEADERS)
-        elif name == "get_votes_by_target":
-            resp = requests.get(f"{API_BASE_URL}/votes/{args['target_type']}/{args['target_id']}", headers=HEADERS, params=args)
-        elif name == "update_vote":
-            resp = requests.put(f"{API_BASE_URL}/votes/{args['id']}", headers=HEADERS, json=args)
-        elif name == "delete_vote":
-            resp = requests.delete(f"{API_BASE_URL}/votes/{args['id']}", headers=HEADERS)
-        elif name == "get_notification":
-            resp = requests.get(f"{API_BASE_URL}/notifications/{args['id']}", headers=HEADERS)
-        elif name == "get_notifications":
-            resp = requests.get(f"{API_BASE_URL}/notifications", headers=HEADERS, params=args)
-        elif name == "mark_notification_read":
-            _id = args["id"]
-            resp = requests.put(f"{API_BASE_URL}/notifications/{_id}/read", headers=HEADERS)
-        elif name == "mark_all_notifications_read":
-            resp = requests.put(f"{API_BASE_URL}/notifications/read-all", headers=HEADERS)
-        elif name == "delete_notification":
-            resp = requests.delete(f"{API_BASE_URL}/notifications/{args['id']}", headers=HEADERS)
-        elif name == "get_unread_notification_count":
-            resp = requests.get(f"{API_BASE_URL}/notifications/unread", headers=HEADERS)
-        else:
+        if name == "run_plan":
+            return run_plan(args.get("steps"), call_tool, extract_items)
+        if name == "get_notifications" and _TRIAGE is not None:
+            return triage_notifications(args)
+        if name == "get_threaded_replies":
+            return THREADS.sync(args["post_id"], full=args.get("full", False))
+        resp = _request(name, args)
+        if resp is None:
             return {"error": f"Unknown tool: {name}"}
-
-        try:
-            return resp.json()
-        except Exception as e:
-            print(f"[API ERROR] {name} {args}")
-            print(f"Status: {resp.status_code}")
-            print("Raw response:", resp.text)
-            return {"error": f"Failed to parse JSON: {e}", "status_code": resp.status_code, "raw": resp.text}
+        return _read_json(resp, name, args)
+    except PlanError as e:
+        return {"error": f"Invalid plan: {e}"}
     except Exception as e:
         print(f"[TOOL CALL ERROR] {name} {args}")
         print(f"Exception: {e}")
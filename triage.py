@@ -0,0 +1,93 @@
+"""
+Rule-based triage of notifications before they reach the model.
+Rules come from the `triage` section of config.yaml and are checked in order;
+the first rule whose `match` fields all equal the notification's decides it.
+"""
+
+DEFAULT_CONFIG = {
+    "max_items": 10,
+    "default_priority": 1,
+    "dedupe_by": ["type", "target_id"],
+    "fields": None,
+    "rules": [],
+}
+ACTIONS = {"keep", "mark_read", "ignore"}
+
+
+class Triage:
+    def __init__(self, config=None):
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
+        for rule in self.config["rules"]:
+            if rule.get("action", "keep") not in ACTIONS:
+                raise ValueError(f"Unknown triage action: {rule['action']}")
+        # Notifications already passed to the model, in case the API still lists them as unread
+        self.delivered = set()
+
+    def classify(self, notification, agent_id):
+        """Return (action, priority) for a notification."""
+        if notification.get("is_read"):
+            return "ignore", 0
+        for rule in self.config["rules"]:
+            if all(_matches(notification.get(field), expected, agent_id)
+                   for field, expected in rule.get("match", {}).items()):
+                return rule.get("action", "keep"), rule.get("priority", self.config["default_priority"])
+        return "keep", self.config["default_priority"]
+
+    def run(self, notifications, agent_id):
+        """
+        Classify, deduplicate and rank notifications.
+        Returns the compact batch for the model and the ids to mark read locally.
+        """
+        kept = {}
+        handled = []
+        ignored = 0
+        for notification in notifications:
+            action, priority = self.classify(notification, agent_id)
+            if action == "mark_read":
+                handled.append(notification.get("id"))
+                continue
+            if action == "ignore" or notification.get("id") in self.delivered:
+                ignored += 1
+                continue
+            key = self._dedupe_key(notification)
+            if key in kept:
+                # Duplicates are folded into the first one
+                kept[key][1]["count"] = kept[key][1].get("count", 1) + 1
+                kept[key][2].append(notification.get("id"))
+                continue
+            kept[key] = (priority, self._compact(notification), [notification.get("id")])
+        ranked = sorted(kept.values(), key=lambda entry: entry[0], reverse=True)
+        delivered = ranked[:self.config["max_items"]]
+        items = [item for _, item, _ in delivered]
+        # Delivered items and their duplicates are marked read once handed over,
+        # so they stop filling the first page; deferred ones stay unread for a later batch
+        for _, _, ids in delivered:
+            self.delivered.update(ids)
+            handled += ids
+        return {
+            "items": items,
+            "handled": [_id for _id in handled if _id is not None],
+            "ignored": ignored,
+            "deferred": len(ranked) - len(items),
+        }
+
+    def _dedupe_key(self, notification):
+        """Dedupe on the dedupe_by fields only when all of them are present."""
+        values = tuple(notification.get(field) for field in self.config["dedupe_by"])
+        if values and None not in values:
+            return values
+        return ("id", notification.get("id"))
+
+    def _compact(self, notification):
+        fields = self.config["fields"]
+        if not fields:
+            return dict(notification)
+        return {field: notification[field] for field in fields if field in notification}
+
+
+def _matches(value, expected, agent_id):
+    if isinstance(expected, list):
+        return any(_matches(value, option, agent_id) for option in expected)
+    if expected == "$agent_id":
+        expected = agent_id
+    return value == expected